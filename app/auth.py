@@ -1,16 +1,33 @@
 """Authentication helpers for password hashing and verification."""
-from passlib.context import CryptContext
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Argon2id с параметрами OWASP (46 MiB, t=2, p=1)
+ph = PasswordHasher(time_cost=2, memory_cost=46 * 1024, parallelism=1)
+
+_BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
 
 
 def hash_password(password: str) -> str:
-    """Hash plain password using bcrypt."""
-    return pwd_context.hash(password)
+    """Hash plain password using Argon2id."""
+    return ph.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against stored hash."""
+    """Verify password against stored hash (Argon2id or legacy bcrypt)."""
     if not hashed_password:
         return False
-    return pwd_context.verify(plain_password, hashed_password)
+    if hashed_password.startswith(_BCRYPT_PREFIXES):
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+    try:
+        return ph.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Return True if the hash is legacy bcrypt or uses outdated Argon2 params."""
+    if hashed_password.startswith(_BCRYPT_PREFIXES):
+        return True
+    return ph.check_needs_rehash(hashed_password)
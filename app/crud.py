@@ -1,14 +1,20 @@
 ﻿"""Database helper functions."""
 from __future__ import annotations
 
+import os
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
-from uuid import uuid4
+from typing import List, Optional, Tuple
+from uuid import UUID, uuid4
 
 import qrcode
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+import qrcode.constants
+from fastapi import BackgroundTasks
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, load_only, selectinload
 
 from . import models, schemas
 from .auth import hash_password
@@ -17,38 +23,126 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 QR_CODES_DIR = BASE_DIR / "static" / "qrcodes"
 QR_CODES_DIR.mkdir(parents=True, exist_ok=True)
 
+# Заранее посчитанный Argon2id-хеш пароля "admin" (параметры как у auth.ph),
+# чтобы не хешировать пароль при старте приложения
+DEFAULT_ADMIN_HASH = (
+    "$argon2id$v=19$m=47104,t=2,p=1$/XWrkLUSIORhj+VYC1DVmA$"
+    "Skwg3sliRNZikscMCnF5s1i10d27tOpbovuJEAPkInU"
+)
+
+# Версия инвентаря растёт после каждого изменения оборудования; по ней
+# инвалидируются кеши списка. Счётчик свой в каждом процессе, поэтому у
+# кешей есть ещё и короткий TTL (изменения из других воркеров).
+INVENTORY_CACHE_TTL = 5.0
+_inventory_version = 0
+_list_cache: Optional[Tuple[int, float, List[Row]]] = None
+
+
+def get_inventory_version() -> int:
+    return _inventory_version
+
+
+def _bump_inventory_version() -> None:
+    global _inventory_version
+    _inventory_version += 1
+
+
+def _qrcode_path(equipment_uuid: str) -> str:
+    return f"qrcodes/{equipment_uuid}.png"
+
 
 def _save_qrcode(equipment_uuid: str) -> str:
-    filename = f"{equipment_uuid}.png"
-    file_path = QR_CODES_DIR / filename
-    qr_img = qrcode.make(equipment_uuid)
-    qr_img.save(str(file_path))
-    return f"qrcodes/{filename}"
+    file_path = QR_CODES_DIR / f"{equipment_uuid}.png"
+    # Уровень коррекции L и мелкий модуль: матрица меньше, PNG рендерится быстрее
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=4)
+    qr.add_data(equipment_uuid)
+    qr.make(fit=True)
+    # Пишем во временный файл и атомарно переименовываем, чтобы читатели
+    # (и параллельный рендер того же QR) никогда не видели недописанный PNG
+    tmp_path = QR_CODES_DIR / (
+        f"{equipment_uuid}.{os.getpid()}.{threading.get_ident()}.tmp"
+    )
+    try:
+        with open(tmp_path, "wb") as stream:
+            qr.make_image().save(stream)
+        os.replace(tmp_path, file_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return _qrcode_path(equipment_uuid)
+
+
+def get_qrcode_file(db: Session, equipment_uuid: str) -> Optional[Path]:
+    """Return the QR PNG path, rendering it if the background task hasn't yet."""
+    # Проверяем UUID до обращения к диску: иначе на Windows сегменты "..\"
+    # в параметре пути позволили бы выйти за пределы QR_CODES_DIR
+    if not _is_valid_uuid(equipment_uuid):
+        return None
+    file_path = QR_CODES_DIR / f"{equipment_uuid}.png"
+    if file_path.is_file():
+        return file_path
+    if not get_equipment_by_uuid(db, equipment_uuid):
+        return None
+    _save_qrcode(equipment_uuid)
+    return file_path
 
 
-def create_equipment(db: Session, equipment_in: schemas.EquipmentCreate) -> models.Equipment:
+def create_equipment(
+    db: Session,
+    equipment_in: schemas.EquipmentCreate,
+    background_tasks: BackgroundTasks,
+) -> models.Equipment:
     equipment_uuid = str(uuid4())
-    qrcode_path = _save_qrcode(equipment_uuid)
     db_equipment = models.Equipment(
         uuid=equipment_uuid,
         name=equipment_in.name,
         location=equipment_in.location,
         notes=equipment_in.notes,
         status=schemas.EquipmentStatus.available.value,
-        qrcode_path=qrcode_path,
+        qrcode_path=_qrcode_path(equipment_uuid),
     )
     db.add(db_equipment)
+    db.flush()  # нужен только id для записи истории
+    log_history(db, db_equipment.id, action="Создана запись", commit=False)
     db.commit()
-    db.refresh(db_equipment)
-    log_history(db, db_equipment.id, action="Создана запись")
+    _bump_inventory_version()
+    # PNG генерируется уже после отправки ответа
+    background_tasks.add_task(_save_qrcode, equipment_uuid)
     return db_equipment
 
 
-def list_equipment(db: Session) -> List[models.Equipment]:
-    return db.query(models.Equipment).order_by(models.Equipment.name.asc()).all()
+def list_equipment(db: Session) -> List[Row]:
+    global _list_cache
+    version = _inventory_version
+    now = time.monotonic()
+    if (
+        _list_cache
+        and _list_cache[0] == version
+        and now - _list_cache[1] < INVENTORY_CACHE_TTL
+    ):
+        return _list_cache[2]
+    # Списку нужны только эти колонки: лёгкие Row вместо ORM-объектов
+    stmt = select(
+        models.Equipment.uuid,
+        models.Equipment.name,
+        models.Equipment.location,
+        models.Equipment.status,
+    ).order_by(models.Equipment.name.asc())
+    rows = db.execute(stmt).all()
+    _list_cache = (version, now, rows)
+    return rows
+
+
+def _is_valid_uuid(value: str) -> bool:
+    # Принимаем только канонический вид, как и при прежнем строковом сравнении
+    try:
+        return str(UUID(value)) == value
+    except ValueError:
+        return False
 
 
 def get_equipment_by_uuid(db: Session, equipment_uuid: str) -> Optional[models.Equipment]:
+    if not _is_valid_uuid(equipment_uuid):
+        return None
     return (
         db.query(models.Equipment)
         .filter(models.Equipment.uuid == equipment_uuid)
@@ -57,10 +151,14 @@ def get_equipment_by_uuid(db: Session, equipment_uuid: str) -> Optional[models.E
 
 
 def get_equipment_detail(db: Session, equipment_uuid: str) -> Optional[models.Equipment]:
-    equipment = get_equipment_by_uuid(db, equipment_uuid)
-    if equipment:
-        _ = equipment.histories  # trigger lazy load
-    return equipment
+    if not _is_valid_uuid(equipment_uuid):
+        return None
+    return (
+        db.query(models.Equipment)
+        .options(selectinload(models.Equipment.histories))
+        .filter(models.Equipment.uuid == equipment_uuid)
+        .first()
+    )
 
 
 def update_equipment_status(
@@ -76,21 +174,29 @@ def update_equipment_status(
         equipment.issued_at = now
     if (
         status == schemas.EquipmentStatus.available
-        and previous_status == schemas.EquipmentStatus.issued.value
+        and previous_status == schemas.EquipmentStatus.issued
     ):
         equipment.returned_at = now
     equipment.updated_at = now
+    log_history(db, equipment.id, action=f"Статус изменён на {status.value}", commit=False)
     db.commit()
-    db.refresh(equipment)
-    log_history(db, equipment.id, action=f"Статус изменён на {status.value}")
+    _bump_inventory_version()
     return equipment
 
 
-def log_history(db: Session, equipment_id: int, action: str, user: Optional[str] = None) -> models.History:
+def log_history(
+    db: Session,
+    equipment_id: int,
+    action: str,
+    user: Optional[str] = None,
+    commit: bool = True,
+) -> models.History:
     entry = models.History(equipment_id=equipment_id, action=action, user=user)
     db.add(entry)
+    if not commit:
+        # Коммит выполнит вызывающий код в рамках своей транзакции
+        return entry
     db.commit()
-    db.refresh(entry)
     return entry
 
 
@@ -100,8 +206,9 @@ def add_history_entry(
     equipment = get_equipment_by_uuid(db, equipment_uuid)
     if not equipment:
         return None
-    log_history(db, equipment.id, history_in.action, history_in.user)
-    db.refresh(equipment)
+    log_history(db, equipment.id, history_in.action, history_in.user, commit=False)
+    db.commit()
+    # histories подгрузятся одним запросом при сериализации ответа
     return equipment
 
 
@@ -124,9 +231,9 @@ def update_equipment_details(
     if not has_changes:
         return equipment
     equipment.updated_at = datetime.utcnow()
+    log_history(db, equipment.id, action="Данные оборудования обновлены", commit=False)
     db.commit()
-    db.refresh(equipment)
-    log_history(db, equipment.id, action="Данные оборудования обновлены")
+    _bump_inventory_version()
     return equipment
 
 
@@ -136,6 +243,7 @@ def delete_equipment(db: Session, equipment_uuid: str) -> bool:
         return False
     db.delete(equipment)
     db.commit()
+    _bump_inventory_version()
     return True
 
 
@@ -143,6 +251,16 @@ def get_user(db: Session, user_id: int) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 
+def get_session_user(db: Session, user_id: int) -> Optional[models.User]:
+    # Для авторизации нужны только id/логин/роль, хеш пароля не загружаем
+    return (
+        db.query(models.User)
+        .options(load_only(models.User.id, models.User.username, models.User.role))
+        .filter(models.User.id == user_id)
+        .first()
+    )
+
+
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return (
         db.query(models.User)
@@ -163,7 +281,6 @@ def create_user(db: Session, user_in: schemas.UserCreate) -> models.User:
     )
     db.add(user)
     db.commit()
-    db.refresh(user)
     return user
 
 
@@ -177,17 +294,38 @@ def set_user_role(db: Session, user_id: int, role: str) -> Optional[models.User]
         return None
     user.role = role
     db.commit()
-    db.refresh(user)
     return user
 
 
+def update_user_password(db: Session, user: models.User, password: str) -> models.User:
+    user.hashed_password = hash_password(password)
+    db.commit()
+    return user
+
+
+def migrate_text_uuids(db: Session) -> None:
+    """Convert equipment.uuid values stored as text by older versions to bytes."""
+    rows = db.execute(
+        text("SELECT id, uuid FROM equipment WHERE typeof(uuid) = 'text'")
+    ).all()
+    if not rows:
+        return
+    for equipment_id, equipment_uuid in rows:
+        db.execute(
+            text("UPDATE equipment SET uuid = :uuid WHERE id = :id"),
+            {"uuid": UUID(equipment_uuid).bytes, "id": equipment_id},
+        )
+    db.commit()
+
+
 def ensure_default_admin(db: Session) -> None:
-    if db.query(models.User).count():
+    # Для проверки «есть ли записи» используем EXISTS, а не COUNT(*)
+    if db.query(db.query(models.User.id).exists()).scalar():
         return
     admin = models.User(
         username="admin",
         role="admin",
-        hashed_password=hash_password("admin"),
+        hashed_password=DEFAULT_ADMIN_HASH,
     )
     db.add(admin)
     db.commit()
@@ -1,16 +1,39 @@
 """Database configuration for Smart Inventory application."""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./inventory.db"
 
+# QueuePool держит соединения открытыми, поэтому PRAGMA ниже выполняются
+# один раз на соединение. StaticPool не подходит: синхронные маршруты
+# работают в пуле потоков и делили бы одно соединение sqlite3.
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=20,
+    max_overflow=40,
+)
+# Сессия живёт один запрос, поэтому объекты не нужно перечитывать после commit:
+# значения уже в памяти, серверные умолчания приходят через RETURNING
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for the commit-heavy CRUD paths (WAL, 64 MiB page cache)."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 def get_db():
     """Yield a scoped database session."""
     db = SessionLocal()
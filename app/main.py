@@ -1,28 +1,51 @@
 ﻿"""FastAPI entry point for the Smart Inventory project."""
 from __future__ import annotations
 
+import os
+import time
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
-from fastapi import Depends, FastAPI, HTTPException, Request, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 
 from . import crud, models, schemas
-from .auth import verify_password
+from .auth import needs_rehash, verify_password
 from .database import Base, SessionLocal, engine, get_db
 
 Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Smart Inventory with QR system")
+# create_all не добавляет новые индексы в уже существующие таблицы
+with engine.begin() as _conn:
+    for _table in Base.metadata.sorted_tables:
+        for _index in _table.indexes:
+            _conn.execute(CreateIndex(_index, if_not_exists=True))
+
+app = FastAPI(
+    title="Smart Inventory with QR system", default_response_class=ORJSONResponse
+)
 app.add_middleware(SessionMiddleware, secret_key="smart-inventory-demo-secret")
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+# Режим разработки: шаблоны перечитываются с диска при изменении.
+# В продакшене (по умолчанию) проверка файлов на каждый рендер отключена.
+DEBUG = os.getenv("SMART_INVENTORY_DEBUG", "").lower() in ("1", "true", "yes")
+
+_templates_env = Environment(
+    loader=FileSystemLoader(str(BASE_DIR / "templates")),
+    autoescape=True,
+    auto_reload=DEBUG,
+    cache_size=400,
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+templates = Jinja2Templates(env=_templates_env)
 def _format_datetime(value):
     if not value:
         return "-"
@@ -31,25 +54,31 @@ def _format_datetime(value):
 
 templates.env.filters["format_dt"] = _format_datetime
 
-STATUS_LABELS: Dict[str, str] = {
-    schemas.EquipmentStatus.available.value: "В наличии",
-    schemas.EquipmentStatus.issued.value: "Выдано",
-    schemas.EquipmentStatus.lost.value: "Потеряно",
-}
-STATUS_BADGES: Dict[str, str] = {
-    schemas.EquipmentStatus.available.value: "success",
-    schemas.EquipmentStatus.issued.value: "warning",
-    schemas.EquipmentStatus.lost.value: "danger",
+# статус -> (подпись, цвет бейджа)
+STATUS_META: Dict[str, Tuple[str, str]] = {
+    item_status.value: (label, badge)
+    for item_status, label, badge in [
+        (schemas.EquipmentStatus.available, "В наличии", "success"),
+        (schemas.EquipmentStatus.issued, "Выдано", "warning"),
+        (schemas.EquipmentStatus.lost, "Потеряно", "danger"),
+    ]
 }
+templates.env.globals["status_meta"] = STATUS_META
+
+
+_MISSING = object()
 
 
 def get_current_user(
     request: Request, db: Session = Depends(get_db)
 ) -> Optional[models.User]:
+    cached = getattr(request.state, "_user_cache", _MISSING)
+    if cached is not _MISSING:
+        return cached
     user_id = request.session.get("user_id")
-    if not user_id:
-        return None
-    return crud.get_user(db, int(user_id))
+    user = crud.get_session_user(db, int(user_id)) if user_id else None
+    request.state._user_cache = user
+    return user
 
 
 def require_admin(user: Optional[models.User] = Depends(get_current_user)) -> models.User:
@@ -64,6 +93,7 @@ def require_admin(user: Optional[models.User] = Depends(get_current_user)) -> mo
 def ensure_default_admin():
     db = SessionLocal()
     try:
+        crud.migrate_text_uuids(db)
         crud.ensure_default_admin(db)
     finally:
         db.close()
@@ -86,13 +116,21 @@ async def login(request: Request, db: Session = Depends(get_db)):
     username = form.get("username")
     password = form.get("password")
     user = crud.get_user_by_username(db, username or "") if username else None
-    if not user or not password or not verify_password(password, user.hashed_password):
+    # Проверка хеша нагружает CPU, выполняем её вне цикла событий
+    if (
+        not user
+        or not password
+        or not await run_in_threadpool(verify_password, password, user.hashed_password)
+    ):
         context = {
             "request": request,
             "error": "Неверный логин или пароль",
             "current_user": None,
         }
         return templates.TemplateResponse("login.html", context, status_code=400)
+    if needs_rehash(user.hashed_password):
+        # Перехешируем старые bcrypt-хеши в Argon2id при успешном входе
+        await run_in_threadpool(crud.update_user_password, db, user, password)
     request.session["user_id"] = user.id
     return RedirectResponse("/", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -117,8 +155,8 @@ async def register(request: Request, db: Session = Depends(get_db)):
         if "application/json" in content_type:
             payload = await request.json()
             user_in = schemas.UserCreate(**payload)
-            user = crud.create_user(db, user_in)
-            return schemas.UserOut.from_orm(user)
+            user = await run_in_threadpool(crud.create_user, db, user_in)
+            return schemas.UserOut.model_validate(user)
 
         # HTML form
         form = await request.form()
@@ -127,7 +165,7 @@ async def register(request: Request, db: Session = Depends(get_db)):
         if not username or not password:
             raise HTTPException(status_code=400, detail="Username and password required")
         user_in = schemas.UserCreate(username=username, password=password)
-        crud.create_user(db, user_in)
+        await run_in_threadpool(crud.create_user, db, user_in)
         # auto login after registration
         new_user = crud.get_user_by_username(db, username)
         request.session["user_id"] = new_user.id
@@ -152,21 +190,38 @@ def logout(
     return RedirectResponse("/", status_code=status.HTTP_303_SEE_OTHER)
 
 
+# Готовый HTML главной страницы: (версия инвентаря, id, роль) -> (время, тело)
+LIST_PAGE_CACHE_SIZE = 64
+_list_page_cache: Dict[Tuple[int, Optional[int], Optional[str]], Tuple[float, bytes]] = {}
+
+
 @app.get("/", response_class=HTMLResponse)
 def list_equipment(
     request: Request,
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user),
 ):
+    # Страница зависит от пользователя (имя и роль в шапке, форма для админа)
+    cache_key = (
+        crud.get_inventory_version(),
+        current_user.id if current_user else None,
+        current_user.role if current_user else None,
+    )
+    now = time.monotonic()
+    cached = _list_page_cache.get(cache_key)
+    if cached and now - cached[0] < crud.INVENTORY_CACHE_TTL:
+        return HTMLResponse(cached[1])
     equipment = crud.list_equipment(db)
     context = {
         "request": request,
         "equipment": equipment,
-        "status_labels": STATUS_LABELS,
-        "status_badges": STATUS_BADGES,
         "current_user": current_user,
     }
-    return templates.TemplateResponse("add_equipment.html", context)
+    response = templates.TemplateResponse("add_equipment.html", context)
+    if len(_list_page_cache) >= LIST_PAGE_CACHE_SIZE:
+        _list_page_cache.clear()
+    _list_page_cache[cache_key] = (now, response.body)
+    return response
 
 
 # ----------------------
@@ -245,43 +300,74 @@ def item_detail(
     context = {
         "request": request,
         "equipment": equipment,
-        "status_labels": STATUS_LABELS,
-        "status_badges": STATUS_BADGES,
         "current_user": current_user,
     }
     return templates.TemplateResponse("item.html", context)
 
 
+@app.get("/qrcodes/{equipment_uuid}.png")
+def qrcode_image(
+    equipment_uuid: str, request: Request, db: Session = Depends(get_db)
+):
+    file_path = crud.get_qrcode_file(db, equipment_uuid)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="QR code not found")
+    # Файл появляется только после завершённого рендера (атомарная запись),
+    # а содержимое QR зависит только от UUID, поэтому кешируем навсегда
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{equipment_uuid}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return FileResponse(file_path, media_type="image/png", headers=headers)
+
+
+MAX_EQUIPMENT_BODY_SIZE = 64 * 1024
+
+
+def _content_length(request: Request) -> int:
+    try:
+        return int(request.headers.get("content-length", "0"))
+    except ValueError:
+        return 0
+
+
 @app.post("/equipment/add")
 async def add_equipment(
     request: Request,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user),
 ):
     content_type = request.headers.get("content-type", "")
-    expects_html = "application/json" not in content_type
+    is_json = content_type.startswith("application/json")
 
     if not current_user:
-        if expects_html:
+        if not is_json:
             return RedirectResponse("/login", status_code=status.HTTP_303_SEE_OTHER)
         raise HTTPException(status_code=401, detail="Authentication required")
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin privileges required")
+    # Отсекаем слишком большие тела до их чтения и разбора
+    if _content_length(request) > MAX_EQUIPMENT_BODY_SIZE:
+        raise HTTPException(status_code=413, detail="Request body too large")
 
-    if "application/json" in content_type:
+    if is_json:
         payload = await request.json()
         equipment_in = schemas.EquipmentCreate(**payload)
-        equipment = crud.create_equipment(db, equipment_in)
-        return equipment
+        equipment = crud.create_equipment(db, equipment_in, background_tasks)
+        return schemas.EquipmentOut.model_validate(equipment)
 
-    form = await request.form()
+    # Файлы в форме не ожидаются, полей всего три
+    form = await request.form(max_files=0, max_fields=16)
     name = form.get("name")
     location = form.get("location")
     notes = form.get("notes")
     if not name or not location:
         raise HTTPException(status_code=400, detail="Name and location are required")
     equipment_in = schemas.EquipmentCreate(name=name, location=location, notes=notes)
-    crud.create_equipment(db, equipment_in)
+    crud.create_equipment(db, equipment_in, background_tasks)
     return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
 
 
@@ -322,7 +408,7 @@ def add_history_entry(
     equipment = crud.add_history_entry(db, equipment_uuid, history_in)
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
-    return crud.get_equipment_detail(db, equipment_uuid)
+    return equipment
 
 
 @app.patch(
@@ -337,7 +423,7 @@ def update_equipment_details_api(
     equipment = crud.update_equipment_details(db, equipment_uuid, update_in)
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
-    return crud.get_equipment_detail(db, equipment_uuid)
+    return equipment
 
 
 @app.delete("/equipment/{equipment_uuid}")
@@ -1,12 +1,41 @@
 """SQLAlchemy models for Smart Inventory."""
 from datetime import datetime
+from uuid import UUID
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import (
+    BINARY,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    func,
+)
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 from .database import Base
 
 
+class UUIDBinary(TypeDecorator):
+    """UUID stored as 16 raw bytes, exposed to Python as the hyphenated string."""
+
+    impl = BINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return UUID(str(value)).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(UUID(bytes=value))
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -15,12 +44,18 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     role = Column(String, nullable=False, default="user")
 
+    # get_user_by_username сравнивает lower(username), индекс по выражению
+    # позволяет делать это поиском по btree, а не полным сканированием
+    __table_args__ = (
+        Index("ix_users_username_lower", func.lower(username), unique=True),
+    )
+
 
 class Equipment(Base):
     __tablename__ = "equipment"
 
     id = Column(Integer, primary_key=True, index=True)
-    uuid = Column(String, unique=True, index=True, nullable=False)
+    uuid = Column(UUIDBinary, unique=True, index=True, nullable=False)
     name = Column(String, nullable=False)
     location = Column(String, nullable=False)
     notes = Column(Text, nullable=True)
@@ -40,7 +75,10 @@ class Equipment(Base):
     returned_at = Column(DateTime, nullable=True)
 
     histories = relationship(
-        "History", back_populates="equipment", cascade="all, delete-orphan"
+        "History",
+        back_populates="equipment",
+        cascade="all, delete-orphan",
+        order_by="[History.timestamp.desc(), History.id.desc()]",
     )
 
 
@@ -54,3 +92,14 @@ class History(Base):
     user = Column(String, nullable=True)
 
     equipment = relationship("Equipment", back_populates="histories")
+
+    # Покрывает выборку истории одного предмета вместе с сортировкой
+    # Equipment.histories, так что строки читаются уже упорядоченными
+    __table_args__ = (
+        Index(
+            "ix_history_equipment_timestamp",
+            equipment_id,
+            timestamp.desc(),
+            id.desc(),
+        ),
+    )
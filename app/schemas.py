@@ -1,9 +1,9 @@
 """Pydantic schemas for requests and responses."""
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class EquipmentStatus(str, Enum):
@@ -28,23 +28,21 @@ class HistoryBase(BaseModel):
 
 
 class HistoryOut(HistoryBase):
-    timestamp: datetime
+    model_config = ConfigDict(from_attributes=True)
 
-    class Config:
-        orm_mode = True
+    timestamp: datetime
 
 
 class EquipmentOut(EquipmentBase):
+    model_config = ConfigDict(from_attributes=True)
+
     uuid: str
     status: EquipmentStatus
-    qrcode_path: Optional[str]
+    qrcode_path: Optional[str] = None
     created_at: datetime
     updated_at: datetime
-    issued_at: Optional[datetime]
-    returned_at: Optional[datetime]
-
-    class Config:
-        orm_mode = True
+    issued_at: Optional[datetime] = None
+    returned_at: Optional[datetime] = None
 
 
 class EquipmentDetail(EquipmentOut):
@@ -69,22 +67,22 @@ class UserCreate(BaseModel):
     username: str = Field(..., max_length=255)
     password: str = Field(..., min_length=4)
     # Роль для публичной регистрации не принимаем, всегда "user". Поле оставлено для совместимости.
-    role: str = Field(default="user")
+    role: str = Field(default="user", validate_default=True)
 
-    @validator("role", pre=True, always=True)
-    def force_user_role(cls, v):  # noqa: N805
+    @field_validator("role", mode="before")
+    @classmethod
+    def force_user_role(cls, v):
         # Защита: игнорируем любое входящее значение и проставляем "user"
         return "user"
 
 
 class UserOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     username: str
     role: str
 
-    class Config:
-        orm_mode = True
-
 
 class RoleUpdate(BaseModel):
-    role: str = Field(..., regex=r"^(user|admin)$")
+    role: Literal["user", "admin"]